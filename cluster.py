@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+#
+# 複数インスタンスで取得済みIDとアウトボックスを共有するクラスタノード
+#
+# すべてのインスタンスがフィードを取得し、新しいentryを共有のアウトボックス(sqlite)に登録する。
+# entryのIDは一意なので、同じentryが複数のインスタンスから登録されても一度しか入らない。
+# アウトボックスの処理(送信)はリースを保持しているリーダーのみが行い、
+# リーダーが停止した場合はリースの期限切れ後にスタンバイがリーダーを引き継ぐ。
+#
+# リーダーはリースを更新するたびに送信中のentryの更新時間も更新し、
+# 他のノードは更新時間からleaseTime秒以上経過した送信中のentryのみを引き継ぐ。
+# 停止時は送信中のentryの完了を待ってからリースを手放すので、通常の切り替えでは二重送信は起きない。
+# ただし送信中にプロセスが強制終了した場合や、送信中にリースを失った場合は、
+# 新しいリーダーがそのentryを再送する(少なくとも一度は送信する)。
+#
+# リーダーがパースした報告は共有のreportsテーブルに保存され、
+# リーダーも含めた各ノードはそれを読み込んでローカル配信サーバーに配信する(スタンバイも同じ報告を配信できる)。
+#
+class ClusterNode:
+    LEASE_NAME = 'leader'
+
+    #
+    # 引数
+    #   path: 共有するsqliteファイルのパス
+    #   nodeId: ノードの識別子(省略時は ホスト名:PID)
+    #   leaseTime: リースの有効期間(秒)。リーダーが停止してから引き継ぐまでの最大時間の目安になる
+    #   retention: 処理済みのentryを保持する期間(秒)
+    #   stopTimeout: 停止時に送信中のentryの完了を待つ最大時間(秒)
+    #
+    def __init__(self, path, nodeId=None, leaseTime=15, retention=24*60*60, stopTimeout=120):
+        self._logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
+
+        self.path = path
+        self.nodeId = nodeId or '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.leaseTime = leaseTime
+        self.retention = retention
+        self.stopTimeout = stopTimeout
+
+        self.isLeader = False
+        self._running = set() # このノードで処理中のアウトボックスの番号
+        self._reportSeq = 0 # 読み込み済みの報告の番号(起動前に保存されたものは読み込まない)
+        self._reportHandler = None
+        self._reportLock = threading.Lock()
+        self._runningCond = threading.Condition()
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+        self.initDB()
+        self._reportSeq = self.getLastReportSeq()
+
+    #
+    # sqliteへの接続(スレッドごとに接続を作成する)
+    #
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def initDB(self):
+        conn = self.connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entryId TEXT NOT NULL UNIQUE,
+                    data TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    createdAt REAL NOT NULL,
+                    updatedAt REAL NOT NULL
+                )''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS reports (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    entryId TEXT NOT NULL UNIQUE,
+                    data TEXT NOT NULL,
+                    createdAt REAL NOT NULL
+                )''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS lease (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires REAL NOT NULL
+                )''')
+        finally:
+            conn.close()
+
+    #
+    # entryをアウトボックスに登録する
+    # 新しく登録された場合はTrue、他のノードによって登録済みの場合はFalse、
+    # 共有ストアのエラーで登録できなかった場合はNoneを返す
+    #
+    def enqueue(self, data):
+        now = time.time()
+        try:
+            conn = self.connect()
+            try:
+                cur = conn.execute(
+                    'INSERT OR IGNORE INTO outbox (entryId, data, createdAt, updatedAt) VALUES (?, ?, ?, ?)',
+                    (data['id'], json.dumps(data, ensure_ascii=False), now, now)
+                )
+                isNew = cur.rowcount == 1
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._logger.warning('enqueue -> fail : {} ({}) : {}'.format(data['title'], data['id'], e))
+            return None
+
+        if isNew:
+            self._logger.info('enqueued : {} ({})'.format(data['title'], data['id']))
+        else:
+            self._logger.debug('already enqueued : {}'.format(data['id']))
+        return isNew
+
+    #
+    # 保存されている報告の最新の番号を返す
+    #
+    def getLastReportSeq(self):
+        conn = self.connect()
+        try:
+            return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM reports').fetchone()[0]
+        finally:
+            conn.close()
+
+    #
+    # パースした報告を保存し、各ノードから読み込めるようにする
+    # (同じentryの報告が保存済みの場合は無視する)
+    #
+    def storeReport(self, entryId, data):
+        try:
+            conn = self.connect()
+            try:
+                conn.execute(
+                    'INSERT OR IGNORE INTO reports (entryId, data, createdAt) VALUES (?, ?, ?)',
+                    (entryId, json.dumps(data, ensure_ascii=False), time.time())
+                )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._logger.warning('store report -> fail : {} : {}'.format(entryId, e))
+            return
+
+        # 次のループを待たずにこのノードのローカル配信サーバーに配信する
+        self.deliverReports()
+
+    #
+    # 新しく保存された報告を返す
+    #
+    def readReports(self):
+        conn = self.connect()
+        try:
+            rows = conn.execute(
+                'SELECT seq, entryId, data FROM reports WHERE seq > ? ORDER BY seq',
+                (self._reportSeq,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+        out = []
+        for seq, entryId, data in rows:
+            self._reportSeq = seq
+            out.append(json.loads(data))
+        return out
+
+    #
+    # 新しく保存された報告をreportHandlerに渡す
+    #
+    def deliverReports(self):
+        if not self._reportHandler:
+            return
+        with self._reportLock:
+            try:
+                reports = self.readReports()
+            except sqlite3.Error as e:
+                self._logger.warning('cluster store error : {}'.format(e))
+                return
+            for data in reports:
+                try:
+                    self._reportHandler(data)
+                except Exception as e:
+                    self._logger.warning('report handler -> fail : {}'.format(e))
+
+    #
+    # リースを取得または更新する
+    # リーダーであればTrueを返す
+    #
+    def acquireLease(self):
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT owner, expires FROM lease WHERE name = ?', (self.LEASE_NAME,)).fetchone()
+            if row is None or row[0] == self.nodeId or row[1] < now:
+                conn.execute(
+                    'INSERT OR REPLACE INTO lease (name, owner, expires) VALUES (?, ?, ?)',
+                    (self.LEASE_NAME, self.nodeId, now + self.leaseTime)
+                )
+                isLeader = True
+            else:
+                isLeader = False
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        if isLeader and not self.isLeader:
+            self._logger.info('became leader : {}'.format(self.nodeId))
+        elif not isLeader and self.isLeader:
+            self._logger.warning('lost leadership : {}'.format(self.nodeId))
+        self.isLeader = isLeader
+        return isLeader
+
+    #
+    # リースを手放す(停止時に呼ぶことで、スタンバイがすぐに引き継げる)
+    #
+    def releaseLease(self):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM lease WHERE name = ? AND owner = ?', (self.LEASE_NAME, self.nodeId))
+        finally:
+            conn.close()
+        self.isLeader = False
+
+    #
+    # 未処理のentryを自分に割り当てて返す
+    # 他のノード(停止した以前のリーダー)が処理中のまま、leaseTime秒以上更新されていないものも引き継ぐ
+    #
+    def claimEntries(self):
+        now = time.time()
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "UPDATE outbox SET status = 'sending', owner = ?, updatedAt = ?"
+                " WHERE status = 'pending' OR (status = 'sending' AND owner != ? AND updatedAt < ?)",
+                (self.nodeId, now, self.nodeId, now - self.leaseTime)
+            )
+            rows = conn.execute(
+                "SELECT seq, data FROM outbox WHERE status = 'sending' AND owner = ? ORDER BY seq",
+                (self.nodeId,)
+            ).fetchall()
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        with self._runningCond:
+            rows = [(seq, json.loads(data)) for seq, data in rows if seq not in self._running]
+            self._running.update(seq for seq, _ in rows)
+        return rows
+
+    #
+    # 処理中のentryの更新時間を更新し、他のノードに引き継がれないようにする
+    #
+    def touchRunning(self):
+        with self._runningCond:
+            running = list(self._running)
+        if not running:
+            return
+
+        conn = self.connect()
+        try:
+            conn.executemany(
+                'UPDATE outbox SET updatedAt = ? WHERE seq = ? AND owner = ?',
+                [(time.time(), seq, self.nodeId) for seq in running]
+            )
+        finally:
+            conn.close()
+
+    #
+    # entryの処理結果を記録する
+    #
+    def finish(self, seq, status):
+        try:
+            conn = self.connect()
+            try:
+                conn.execute(
+                    'UPDATE outbox SET status = ?, updatedAt = ? WHERE seq = ? AND owner = ?',
+                    (status, time.time(), seq, self.nodeId)
+                )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            self._logger.warning('cluster store error : {}'.format(e))
+        finally:
+            with self._runningCond:
+                self._running.discard(seq)
+                self._runningCond.notify_all()
+
+    #
+    # 保持期間を過ぎたentryを削除する
+    #
+    def prune(self):
+        conn = self.connect()
+        try:
+            conn.execute('DELETE FROM outbox WHERE createdAt < ?', (time.time() - self.retention,))
+            conn.execute('DELETE FROM reports WHERE createdAt < ?', (time.time() - self.retention,))
+        finally:
+            conn.close()
+
+    #
+    # entryを処理し、結果を記録する
+    #
+    def runEntry(self, handler, seq, data):
+        self._logger.info('execute : {} ({})'.format(data['title'], data['id']))
+        try:
+            handler(data)
+        except Exception as e:
+            self._logger.error('execute -> fail : {} ({}) : {}'.format(data['title'], data['id'], e))
+            self.finish(seq, 'failed')
+        else:
+            self.finish(seq, 'done')
+
+    #
+    # リースの更新とアウトボックスの処理を繰り返す
+    #
+    def loop(self, handler):
+        interval = self.leaseTime / 3
+        while not self._stopEvent.is_set():
+            self.deliverReports()
+
+            try:
+                if self.acquireLease():
+                    self.touchRunning()
+                    for seq, data in self.claimEntries():
+                        threading.Thread(target=self.runEntry, args=(handler, seq, data)).start()
+                    self.prune()
+            except sqlite3.Error as e:
+                self._logger.warning('cluster store error : {}'.format(e))
+            self._stopEvent.wait(interval)
+
+    #
+    # バックグラウンドでリースの更新とアウトボックスの処理を開始する
+    # handler: entryを処理する関数
+    # reportHandler: 保存された報告を受け取る関数
+    #
+    def start(self, handler, reportHandler):
+        self._logger.info('starting cluster node : {} ({})'.format(self.nodeId, self.path))
+        self._reportHandler = reportHandler
+        self._thread = threading.Thread(target=self.loop, args=(handler,), daemon=True)
+        self._thread.start()
+
+    #
+    # 停止する
+    # 送信中のentryが完了するまで(最大stopTimeout秒)待ってからリースを手放す
+    #
+    def stop(self):
+        self._stopEvent.set()
+        if self._thread:
+            self._thread.join()
+
+        deadline = time.time() + self.stopTimeout
+        while 1:
+            with self._runningCond:
+                if not self._running:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._logger.warning('stopped with {} running entries'.format(len(self._running)))
+                    break
+                self._logger.info('waiting for {} running entries'.format(len(self._running)))
+                self._runningCond.wait(min(self.leaseTime / 3, remaining))
+
+            # 待機中もリースと処理中のentryの更新時間を更新し、他のノードに引き継がれないようにする
+            try:
+                if self.acquireLease():
+                    self.touchRunning()
+            except sqlite3.Error as e:
+                self._logger.warning('cluster store error : {}'.format(e))
+
+        try:
+            self.releaseLease()
+        except sqlite3.Error as e:
+            self._logger.warning('cluster store error : {}'.format(e))
+        self._logger.info('stopped cluster node : {}'.format(self.nodeId))
@@ -14,16 +14,20 @@ class JMAQuakeXML:
     #
     # init
     #
-    def __init__(self):
+    def __init__(self, cluster=None):
         self._logger = logging.getLogger(f'{__name__}.{self.__class__.__name__}')
         
         self.feed_lastModified = None # 最後に取得したフィードの更新時間を記録する
         self.feed_idList = []
+        self.cluster = cluster # クラスタモードの場合のノード(cluster.ClusterNode)
 
     #
     # メインループ
     #
     def mainloop(self, skipFirst=True, sleep=30):
+        if self.cluster:
+            self.cluster.start(self.runEntry, self.update_clusterReport)
+
         if skipFirst:
             self.initIdList()
         else:
@@ -133,21 +137,43 @@ class JMAQuakeXML:
 
         # entry処理
         for data in entryDatas:
-            func = None
-            args = (data,)
-            if data['title'] == '震源に関する情報':
-                func = self.update_eqCenter
-            elif data['title'] == '震度速報':
-                func = self.update_eqIntensity
-            elif data['title'] == '震源・震度に関する情報':
-                func = self.update_eqVerbose
-
-            if func:
-                threading.Thread(target=func, args=args).start()
+            func = self.getEntryFunc(data)
+            if not func:
+                continue
+
+            if self.cluster:
+                # クラスタモードでは共有アウトボックスに登録し、処理はリーダーが行う
+                if self.cluster.enqueue(data) is None:
+                    # 登録に失敗した場合は次回の取得で再度登録する
+                    # (フィードが更新されていなくても取得し直すよう、更新時間をリセットする)
+                    self.feed_idList.remove(data['id'])
+                    self.feed_lastModified = None
+            else:
+                threading.Thread(target=func, args=(data,)).start()
         
         self._logger.info('checking feed -> complete')
         return
 
+    #
+    # entryの種類に応じた処理関数を返す
+    #
+    def getEntryFunc(self, data):
+        if data['title'] == '震源に関する情報':
+            return self.update_eqCenter
+        elif data['title'] == '震度速報':
+            return self.update_eqIntensity
+        elif data['title'] == '震源・震度に関する情報':
+            return self.update_eqVerbose
+        return None
+
+    #
+    # entryを処理する(クラスタモードのリーダーから呼ばれる)
+    #
+    def runEntry(self, data):
+        func = self.getEntryFunc(data)
+        if func:
+            func(data)
+
 
     #
     # 震源情報
@@ -166,3 +192,9 @@ class JMAQuakeXML:
     #
     def update_eqVerbose(self, data):
         pass
+
+    #
+    # クラスタモードで共有ストアに保存された報告
+    #
+    def update_clusterReport(self, report):
+        pass
@@ -63,6 +63,19 @@ class EqBase:
             text += ' ' * indent + freeFormComment
         return text
 
+    # headとコメントの情報を辞書形式で返す
+    def todict(self):
+        dic = {}
+        dic['type'] = self.__class__.__name__
+        dic['title'] = self.title
+        dic['infoKind'] = self.infoKind
+        dic['reportDatetime'] = self.reportDatetime_raw
+        dic['eventID'] = self.eventID
+        dic['headText'] = self.headText
+        dic['forecastComment'] = self.forecastComment
+        dic['freeFormComment'] = self.freeFormComment
+        return dic
+
     #
     # Comments配下
     #
@@ -154,6 +167,20 @@ class EqHypocenter(EqBase):
         text += ' ' * indent + '規模: {}'.format(self.magnitude_text)
         return text
 
+    # 震源の情報を辞書形式で返す
+    def todict(self):
+        dic = super().todict()
+        dic['originTime'] = self.originTime_raw
+        dic['hypocenter'] = {
+            'name': self.hypocenterName,
+            'code': self.hypocenterCode,
+            'coordinate': self.coordinate_raw,
+            'coordinate_text': self.coordinate_text
+        }
+        dic['magnitude'] = self.magnitude_raw
+        dic['magnitude_text'] = self.magnitude_text
+        return dic
+
     def tostring(self):
         text = self.tostring_head() + '\n'
         text += '\n'
@@ -236,6 +263,13 @@ class EqIntensity(EqBase):
         text += ' ' * indent + self.tostring_intensityVerbose()
         return text
 
+    # 震度の情報を辞書形式で返す
+    def todict(self):
+        dic = super().todict()
+        dic['maxIntensity'] = self.maxIntensity
+        dic['intensityVerbose'] = self.intensityVerbose
+        return dic
+
     # すべての情報を文字列にして返す
     def tostring(self):
         text = self.tostring_head() + '\n'
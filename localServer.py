@@ -0,0 +1,164 @@
+import json
+import time
+import datetime
+import threading
+import collections
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import logging
+logger = logging.getLogger(__name__)
+
+SSE_KEEPALIVE = 15 # SSEの接続維持のためにコメントを送る間隔(秒)
+
+
+#
+# 直近のイベントを保持するリングバッファ
+# イベントは追加時に一度だけシリアライズし、配信時はそのバイト列を使いまわす
+#
+# イベントのIDは "<起動ID>-<シーケンス番号>" の形式。
+# シーケンス番号は起動ごとに1から採番されるため、別の起動のIDが指定された場合は保持しているすべてのイベントを対象にする
+#
+class EventBuffer:
+    def __init__(self, size=100):
+        self.bootId = str(time.time_ns())
+        self._events = collections.deque(maxlen=size) # (seq, json, sse) のタプル
+        self._lastSeq = 0
+        self._cond = threading.Condition()
+
+    @property
+    def lastSeq(self):
+        return self._lastSeq
+
+    # イベントを追加し、イベントのIDを返す
+    def publish(self, data):
+        with self._cond:
+            self._lastSeq += 1
+            seq = self._lastSeq
+            eventId = '{}-{}'.format(self.bootId, seq)
+            payload = json.dumps({'id': eventId, 'data': data}, ensure_ascii=False)
+            sse = 'id: {}\nevent: report\ndata: {}\n\n'.format(eventId, payload)
+            self._events.append((seq, payload.encode('utf-8'), sse.encode('utf-8')))
+            self._cond.notify_all()
+        return eventId
+
+    # イベントのIDをシーケンス番号に変換する
+    # 別の起動のIDや不正なIDの場合は0(保持しているすべてのイベント)を返す
+    def toSeq(self, eventId):
+        bootId, _, seq = eventId.partition('-')
+        if bootId != self.bootId or not seq.isdigit():
+            return 0
+        return min(int(seq), self._lastSeq)
+
+    # 指定したシーケンス番号より新しいイベントを返す
+    def since(self, seq=0):
+        with self._cond:
+            return [e for e in self._events if e[0] > seq]
+
+    # 指定したシーケンス番号より新しいイベントが追加されるまで待機する
+    def wait(self, seq, timeout=None):
+        with self._cond:
+            self._cond.wait_for(lambda: self._lastSeq > seq, timeout)
+            return [e for e in self._events if e[0] > seq]
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug('{} - {}'.format(self.address_string(), format % args))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        buffer = self.server.buffer
+        since = buffer.toSeq(query['since'][0]) if 'since' in query else None
+
+        if url.path == '/events':
+            events = buffer.since(since or 0)
+            self.sendBody(200, b'[' + b','.join(e[1] for e in events) + b']')
+        elif url.path == '/events/latest':
+            events = buffer.since(0)
+            if events:
+                self.sendBody(200, events[-1][1])
+            else:
+                self.sendBody(404, b'{"error": "no events"}')
+        elif url.path == '/stream':
+            lastEventId = self.headers.get('Last-Event-ID')
+            if lastEventId:
+                since = buffer.toSeq(lastEventId)
+            self.stream(since)
+        else:
+            self.sendBody(404, b'{"error": "not found"}')
+
+    # JSONのレスポンスを返す
+    def sendBody(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Server-Sent-Eventsでイベントを配信し続ける
+    def stream(self, since):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        buffer = self.server.buffer
+        logger.info('stream connected : {}'.format(self.address_string()))
+        try:
+            if since is None:
+                since = buffer.lastSeq
+            while 1:
+                events = buffer.wait(since, timeout=SSE_KEEPALIVE)
+                if events:
+                    self.wfile.write(b''.join(e[2] for e in events))
+                    since = events[-1][0]
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info('stream disconnected : {}'.format(self.address_string()))
+
+
+#
+# jparserでパースした報告を配信用の辞書に変換する
+#
+def reportToDict(report):
+    data = report.todict()
+    data['text'] = report.tostring()
+    data['receivedAt'] = datetime.datetime.now().astimezone().isoformat()
+    return data
+
+
+#
+# パースした報告をHTTP/JSONおよびServer-Sent-Eventsで配信するローカルサーバー
+#
+# エンドポイント
+#   GET /events?since=ID : イベントIDより新しいイベントのリスト
+#   GET /events/latest   : 最新のイベント
+#   GET /stream?since=ID : 新しいイベントをServer-Sent-Eventsで配信する
+#                          (IDを省略した場合は接続以降のイベントのみ。Last-Event-IDヘッダにも対応)
+#
+class LocalServer:
+    def __init__(self, host='127.0.0.1', port=8080, bufferSize=100):
+        self.buffer = EventBuffer(bufferSize)
+
+        self._httpd = ThreadingHTTPServer((host, port), RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.buffer = self.buffer
+
+    def start(self):
+        host, port = self._httpd.server_address[:2]
+        logger.info('starting local server : http://{}:{}'.format(host, port))
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # reportToDictで変換した報告を配信する
+    def publish(self, data):
+        eventId = self.buffer.publish(data)
+        logger.info('published : {} (id {})'.format(data['title'], eventId))
+        return eventId
@@ -4,6 +4,8 @@ import jparser
 import jmaGetter
 from jmaGetter import JMAQuakeXML
 from send import send
+from localServer import LocalServer, reportToDict
+from cluster import ClusterNode
 from config import HOME_NAME
 
 import logging
@@ -37,6 +39,34 @@ def autoRetryRequest(url, retry=3, timeout=10, sleep=10):
 
 
 class MyApp(JMAQuakeXML):
+    def __init__(self, server=None, cluster=None):
+        super().__init__(cluster=cluster)
+        self.server = server # ローカル配信サーバー(LocalServer)
+
+    #
+    # ローカル配信サーバーに報告を配信する
+    # クラスタモードでは共有ストアに保存し、各ノードはupdate_clusterReportで配信する
+    # (通知の送信後に呼び、配信に失敗しても処理は止めない)
+    #
+    def publish(self, ps, data):
+        if not self.server and not self.cluster:
+            return
+        try:
+            report = reportToDict(ps)
+            if self.cluster:
+                self.cluster.storeReport(data['id'], report)
+            else:
+                self.server.publish(report)
+        except Exception as e:
+            self._logger.warning('publish -> fail : {}'.format(e))
+
+    #
+    # クラスタモードで共有ストアに保存された報告
+    #
+    def update_clusterReport(self, report):
+        if self.server:
+            self.server.publish(report)
+
     #
     # 震源情報
     #
@@ -52,6 +82,8 @@ class MyApp(JMAQuakeXML):
         
         send(text)
 
+        self.publish(ps, data)
+
         self._logger.info('execute : {} -> complete'.format(data['title']))
         
 
@@ -73,6 +105,8 @@ class MyApp(JMAQuakeXML):
 
         send(text)
 
+        self.publish(ps, data)
+
         self._logger.info('execute : {} -> complete'.format(data['title']))
 
     #
@@ -93,16 +127,26 @@ class MyApp(JMAQuakeXML):
 
         send(text)
 
+        self.publish(ps, data)
+
         self._logger.info('execute : {} -> complete'.format(data['title']))
 
 
 if __name__ == '__main__':
     import argparse
     from send import logger as logger_send
+    from localServer import logger as logger_server
+    from cluster import logger as logger_cluster
     parser = argparse.ArgumentParser()
     parser.add_argument('--sleep', '-s', default=30, type=int, help='取得頻度')
     parser.add_argument('--loglevel', '-l', default='info', choices=['debug', 'info'], type=str, help='ログ出力レベル')
     parser.add_argument('--notskipfirst', action='store_true', help='すでに発表されている報告をスキップしない')
+    parser.add_argument('--serve', action='store_true', help='ローカル配信サーバーを起動する')
+    parser.add_argument('--host', default='127.0.0.1', type=str, help='ローカル配信サーバーのホスト')
+    parser.add_argument('--port', '-p', default=8080, type=int, help='ローカル配信サーバーのポート')
+    parser.add_argument('--buffersize', default=100, type=int, help='ローカル配信サーバーで保持するイベント数')
+    parser.add_argument('--cluster', type=str, help='クラスタモードで起動し、指定したsqliteファイルで他のインスタンスと取得済みIDを共有する')
+    parser.add_argument('--nodeid', type=str, help='クラスタモードでのノードの識別子(省略時は ホスト名:PID)')
     #parser.add_argument('--out', '-o', type=str, help='チャットの出力先')
 
     args = parser.parse_args()
@@ -119,9 +163,27 @@ if __name__ == '__main__':
     logger.addHandler(streamHandler)
     logger_g.addHandler(streamHandler)
     logger_send.addHandler(streamHandler)
+    logger_server.addHandler(streamHandler)
+    logger_cluster.addHandler(streamHandler)
     logger.setLevel(LOGLEVEL)
     logger_g.setLevel(LOGLEVEL)
     logger_send.setLevel(LOGLEVEL)
-
-    jma = MyApp()
-    jma.mainloop(sleep=args.sleep, skipFirst=not args.notskipfirst)
+    logger_server.setLevel(LOGLEVEL)
+    logger_cluster.setLevel(LOGLEVEL)
+
+    server = None
+    if args.serve:
+        server = LocalServer(args.host, args.port, args.buffersize)
+        server.start()
+
+    cluster = None
+    if args.cluster:
+        # リーダーが停止してから取得間隔以内にスタンバイが引き継げるよう、リースは取得間隔の半分にする
+        cluster = ClusterNode(args.cluster, nodeId=args.nodeid, leaseTime=args.sleep / 2)
+
+    jma = MyApp(server=server, cluster=cluster)
+    try:
+        jma.mainloop(sleep=args.sleep, skipFirst=not args.notskipfirst)
+    finally:
+        if cluster:
+            cluster.stop()